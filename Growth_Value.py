@@ -2,9 +2,15 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import yfinance as yf
-from datetime import datetime, timedelta
-import plotly.express as px
-import io
+from yfinance import shared as yf_shared
+from yfinance.exceptions import YFRateLimitError
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import re
+import time
+import random
+import hashlib
+import diskcache
 
 # ----- APP CONFIGURATION -----
 st.set_page_config(page_title="Growth vs Value Performance Tracker", layout="wide")
@@ -42,6 +48,19 @@ with st.sidebar:
     analyze_button = st.button("Analyze Growth vs Value Performance")
 
 # ----- HELPER FUNCTIONS -----
+# Daily bars only change once per session, so cached prices live for a day
+price_cache = diskcache.Cache('.cache/prices')
+PRICE_CACHE_TTL = 24 * 3600
+DOWNLOAD_RETRIES = 3
+# One "TICKER,STYLE" pair per line; tickers keep any non-space symbol chars (BRK-B, 7203.T, ^GSPC)
+MANUAL_ENTRY_RE = re.compile(r"^[^\S\n]*([^\s,]+)[^\S\n]*,[^\S\n]*(growth|value)[^\S\n]*$", re.I | re.M)
+
+class PriceDownloadError(Exception):
+    # Uncacheable download; carries whatever closes did arrive
+    def __init__(self, closes):
+        super().__init__("Price download incomplete")
+        self.closes = closes
+
 @st.cache_data(ttl=3600)
 def get_company_name(ticker):
     try:
@@ -51,18 +70,50 @@ def get_company_name(ticker):
     except Exception:
         return ticker
 
-def calculate_returns(ticker, days):
-    end_date = datetime.today()
-    start_date = end_date - timedelta(days=days)
-    try:
-        data = yf.download(ticker, start=start_date, end=end_date, progress=False)
-        if len(data) > 0:
-            start_price = data['Close'].iloc[0]
-            end_price = data['Close'].iloc[-1]
-            return (end_price - start_price) / start_price * 100
-        return np.nan
-    except Exception:
-        return np.nan
+def yahoo_rate_limited():
+    # yf.download records per-ticker failures here instead of raising them; the
+    # dict is private, so a missing one reads as "not rate limited"
+    return any('Too Many Requests' in str(err) for err in getattr(yf_shared, '_ERRORS', {}).values())
+
+@st.cache_data(ttl=PRICE_CACHE_TTL, show_spinner=False)
+def download_closes(tickers, start_date, end_date):
+    key = hashlib.md5(f"close|{'|'.join(sorted(tickers))}|{start_date}|{end_date}".encode()).hexdigest()
+    cached = price_cache.get(key)
+    if cached is not None:
+        return cached
+    # Only Yahoo 429s are retried, with exponential backoff. Invalid or delisted
+    # tickers come back empty too, but retrying those would only delay the warning
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        if attempt:
+            time.sleep(2 ** (attempt - 1) + random.random())
+        try:
+            # Column grouping puts every ticker's Close under one top-level key, so the
+            # (dates, tickers) block is a plain column selection and only it is cached
+            data = yf.download(
+                list(tickers),
+                start=start_date,
+                end=end_date + timedelta(days=1),
+                progress=False,
+                threads=True,
+                group_by='column',
+                auto_adjust=False
+            )
+        except YFRateLimitError as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise PriceDownloadError(pd.DataFrame(columns=list(tickers), dtype=np.float32)) from e
+            continue
+        if not yahoo_rate_limited():
+            break
+    if data.empty or 'Close' not in data.columns.get_level_values(0):
+        raise PriceDownloadError(pd.DataFrame(columns=list(tickers), dtype=np.float32))
+    # Returns are shown to 2 decimals, so single precision is plenty and halves the block
+    closes = data['Close'].astype(np.float32).reindex(columns=list(tickers))
+    # Delisted or mistyped symbols stay empty on every retry, so partial results
+    # are cached; only 429 gaps are transient
+    if yahoo_rate_limited():
+        raise PriceDownloadError(closes)
+    price_cache.set(key, closes, expire=PRICE_CACHE_TTL)
+    return closes
 
 def get_days_from_timeframe(tf_label):
     mapping = {
@@ -74,42 +125,115 @@ def get_days_from_timeframe(tf_label):
     }
     return mapping.get(tf_label, 5)
 
+def compute_returns(closes, timeframe_days, today):
+    # closes is (dates, tickers). The last price is each ticker's last valid close
+    # and the start price its first valid close on/after the window cutoff
+    columns = list(timeframe_days)
+    if closes.empty:
+        return pd.DataFrame(np.nan, index=closes.columns, columns=columns)
+    last = closes.ffill().to_numpy()[-1]
+    firsts = closes.bfill().to_numpy()
+    cutoffs = pd.DatetimeIndex([today - timedelta(days=d) for d in timeframe_days.values()])
+    idx = closes.index.searchsorted(cutoffs)
+    n_dates = len(closes.index)
+    start = np.where((idx < n_dates)[:, None], firsts[np.minimum(idx, n_dates - 1)], np.nan)
+    rets = (last / start - 1) * 100
+    return pd.DataFrame(rets.T, index=closes.columns, columns=columns)
+
 def analyze_styles(tickers_df, timeframes):
     if tickers_df.empty:
         st.warning("Please provide at least one valid ticker")
         return None
 
     timeframe_days = {tf: get_days_from_timeframe(tf) for tf in timeframes}
+    max_days = max(timeframe_days.values())
+    # Taken once and pinned to midnight so every ticker and timeframe shares the
+    # same cutoffs, and reruns within a day give the same windows
+    today = pd.Timestamp.today().normalize()
+    tickers = tickers_df['Ticker'].unique()
+    # One batched request covering the longest timeframe; every window is sliced from it
+    try:
+        closes = download_closes(
+            tuple(tickers),
+            (today - timedelta(days=int(max_days * 1.6))).date(),
+            today.date()
+        )
+    except PriceDownloadError as e:
+        # Not cached; carry on with whatever did arrive
+        closes = e.closes
+    # Recomputed on every run so cached partial downloads still report their gaps
+    closes = closes.reindex(columns=tickers)
+    missing = closes.columns[closes.isna().all()].tolist()
+    if missing:
+        st.warning(f"No data returned for: {', '.join(missing)}")
+    returns_df = compute_returns(closes, timeframe_days, today)
     progress_bar = st.progress(0)
     status_text = st.empty()
-    results = []
-    total = len(tickers_df)
-    for i, row in tickers_df.iterrows():
-        ticker = row['Ticker']
-        style = row['Style']
-        status_text.text(f"Processing {ticker} ({i+1}/{total})...")
-        progress_bar.progress((i+1)/total)
-        company = get_company_name(ticker)
-        returns = {}
-        for tf_label, days in timeframe_days.items():
-            ret = calculate_returns(ticker, days)
-            if isinstance(ret, pd.Series):
-                ret = ret.iloc[0] if not ret.empty else np.nan
-            if not pd.isna(ret):
-                returns[tf_label] = float(ret)
-        if returns:
-            results.append({
-                'Ticker': ticker,
-                'Company': company,
-                'Style': style,
-                **returns
-            })
+    total = len(tickers)
+    # Throttle UI updates
+    update_step = max(1, total // 20)
+    # Fetch company names in parallel
+    names = {}
+    with ThreadPoolExecutor(max_workers=min(16, total)) as executor:
+        futures = {executor.submit(get_company_name, ticker): ticker for ticker in tickers}
+        for done, future in enumerate(as_completed(futures), start=1):
+            ticker = futures[future]
+            names[ticker] = future.result()
+            if done % update_step == 0 or done == total:
+                status_text.text(f"Fetched name for {ticker} ({done}/{total})...")
+                progress_bar.progress(done / total)
     progress_bar.empty()
     status_text.empty()
-    if not results:
+    # One row per input row; rows without any return are dropped with a mask
+    rets = returns_df.reindex(tickers_df['Ticker']).to_numpy(dtype=np.float64)
+    keep = ~np.isnan(rets).all(axis=1)
+    if not keep.any():
         st.error("No valid data could be retrieved for the provided tickers.")
         return None
-    return pd.DataFrame(results)
+    kept_tickers = tickers_df['Ticker'].to_numpy()[keep]
+    return pd.DataFrame({
+        'Ticker': kept_tickers,
+        'Company': [names[t] for t in kept_tickers],
+        'Style': tickers_df['Style'].to_numpy()[keep],
+        **{tf: rets[keep, j] for j, tf in enumerate(returns_df.columns)}
+    })
+
+def compute_style_averages(results_df, numeric_cols):
+    # Two fixed groups, so Growth/Value become codes 0/1 and each (style, timeframe)
+    # cell gets its own bincount slot; NaN returns are left out of both sums and counts
+    style_names = np.array(['Growth', 'Value'])
+    n_cols = len(numeric_cols)
+    codes = (results_df['Style'].to_numpy() == 'Value').astype(np.intp)
+    arr = results_df[numeric_cols].to_numpy(dtype=np.float64)
+    present = ~np.isnan(arr)
+    slots = (codes[:, None] * n_cols + np.arange(n_cols)).ravel()
+    sums = np.bincount(slots, weights=np.where(present, arr, 0.0).ravel(), minlength=2 * n_cols)
+    counts = np.bincount(slots, weights=present.ravel(), minlength=2 * n_cols)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums / counts).reshape(2, n_cols)
+    observed = np.bincount(codes, minlength=2) > 0
+    style_avg = pd.DataFrame(means[observed], columns=numeric_cols)
+    style_avg.insert(0, 'Style', style_names[observed])
+    return style_avg
+
+@st.cache_data(show_spinner=False)
+def to_excel_bytes(results_df, style_avg):
+    import io
+    import xlsxwriter
+
+    output = io.BytesIO()
+    # Row-wise writes, as constant_memory requires
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    sheets = [('Stock Performance', results_df)]
+    if style_avg is not None:
+        sheets.append(('Style Averages', style_avg))
+    for sheet_name, df in sheets:
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [str(col) for col in df.columns])
+        for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_idx, 0, [None if pd.isna(v) else v for v in row])
+    workbook.close()
+    return output.getvalue()
 
 # ----- MAIN WORKFLOW -----
 if analyze_button:
@@ -119,27 +243,26 @@ if analyze_button:
         if upload_option == "Upload Excel/CSV File" and uploaded_file is not None:
             try:
                 if uploaded_file.name.endswith('.csv'):
-                    df = pd.read_csv(uploaded_file)
+                    df = pd.read_csv(uploaded_file, engine='pyarrow', dtype_backend='pyarrow')
                 else:
-                    df = pd.read_excel(uploaded_file)
+                    df = pd.read_excel(uploaded_file, usecols=lambda col: col in ('Ticker', 'Style'))
                 # Require Ticker and Style columns
                 if all(col in df.columns for col in ['Ticker', 'Style']):
-                    tickers_df = df[['Ticker', 'Style']].dropna()
-                    tickers_df['Ticker'] = tickers_df['Ticker'].astype(str).str.upper()
-                    tickers_df['Style'] = tickers_df['Style'].str.capitalize()
-                    tickers_df = tickers_df[tickers_df['Style'].isin(['Growth', 'Value'])]
+                    valid_rows = df[['Ticker', 'Style']].dropna()
+                    tickers = np.char.upper(valid_rows['Ticker'].to_numpy(dtype=str))
+                    styles = np.char.capitalize(valid_rows['Style'].to_numpy(dtype=str))
+                    keep = np.isin(styles, ['Growth', 'Value'])
+                    tickers_df = pd.DataFrame({'Ticker': tickers[keep], 'Style': styles[keep]})
                 else:
                     st.error("Your file must have columns 'Ticker' and 'Style' (with values Growth or Value).")
             except Exception as e:
                 st.error(f"Error reading file: {e}")
         elif upload_option == "Enter Manually" and manual_tickers:
-            manual_list = []
-            for line in manual_tickers.strip().split('\n'):
-                parts = [x.strip() for x in line.split(",")]
-                if len(parts) == 2 and parts[1].capitalize() in ["Growth", "Value"]:
-                    manual_list.append({'Ticker': parts[0].upper(), 'Style': parts[1].capitalize()})
-            if manual_list:
-                tickers_df = pd.DataFrame(manual_list)
+            pairs = MANUAL_ENTRY_RE.findall(manual_tickers)
+            if pairs:
+                tickers_df = pd.DataFrame(pairs, columns=['Ticker', 'Style'])
+                tickers_df['Ticker'] = tickers_df['Ticker'].str.upper()
+                tickers_df['Style'] = tickers_df['Style'].str.capitalize()
         # 2. Check input validity
         if tickers_df.empty:
             st.warning("Please provide valid tickers with style (Growth/Value)")
@@ -153,37 +276,42 @@ if analyze_button:
                     # RAW DATA DISPLAY
                     st.subheader("Raw Data")
                     try:
-                        display_df = results_df.copy()
-                        for tf in timeframes:
-                            if tf in display_df.columns:
-                                display_df[tf] = pd.to_numeric(display_df[tf], errors='coerce')
-                        format_dict = {tf: "{:.2f}%" for tf in timeframes if tf in display_df.columns}
-                        st.dataframe(display_df.style.format(format_dict))
+                        # analyze_styles only emits float returns, so style the frame as-is
+                        format_dict = {tf: "{:.2f}%" for tf in timeframes if tf in results_df.columns}
+                        st.dataframe(results_df.style.format(format_dict))
                     except Exception as e:
                         st.error(f"Error formatting data: {e}")
                         st.dataframe(results_df)
                     # STYLE AVERAGES & CHARTS
                     try:
+                        # Lazy import
+                        import plotly.express as px
+
                         numeric_cols = [tf for tf in timeframes if tf in results_df.columns]
-                        style_avg = results_df.groupby('Style')[numeric_cols].mean(numeric_only=True).reset_index()
+                        style_avg = compute_style_averages(results_df, numeric_cols)
                         if not style_avg.empty:
                             st.subheader("Growth vs Value Averages")
-                            for tf in numeric_cols:
-                                fig = px.bar(
-                                    style_avg.sort_values(by=tf, ascending=False),
-                                    x='Style',
-                                    y=tf,
-                                    title=f'Growth vs Value Performance ({tf})',
-                                    labels={tf: 'Return (%)'},
-                                    color='Style',
-                                    height=500
-                                )
-                                fig.update_layout(
-                                    xaxis_title="Style",
-                                    yaxis_title="Return (%)",
-                                    hovermode="x"
-                                )
-                                st.plotly_chart(fig, use_container_width=True)
+                            # One faceted figure for all timeframes instead of a chart per timeframe
+                            long_avg = style_avg.melt(
+                                id_vars='Style',
+                                value_vars=numeric_cols,
+                                var_name='Timeframe',
+                                value_name='Return'
+                            )
+                            fig = px.bar(
+                                long_avg,
+                                x='Style',
+                                y='Return',
+                                title='Growth vs Value Performance',
+                                labels={'Return': 'Return (%)'},
+                                color='Style',
+                                facet_col='Timeframe',
+                                category_orders={'Timeframe': numeric_cols},
+                                height=500
+                            )
+                            fig.for_each_annotation(lambda a: a.update(text=a.text.split("=", 1)[-1]))
+                            fig.update_layout(hovermode="x")
+                            st.plotly_chart(fig, use_container_width=True)
                             # Highlights: Best/Worst
                             st.subheader("Performance Highlights")
                             cols = st.columns(len(numeric_cols))
@@ -205,15 +333,9 @@ if analyze_button:
                         st.error(f"Error calculating group averages: {e}")
                     # DOWNLOAD BUTTON
                     try:
-                        output = io.BytesIO()
-                        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                            results_df.to_excel(writer, sheet_name='Stock Performance', index=False)
-                            if 'style_avg' in locals():
-                                style_avg.to_excel(writer, sheet_name='Style Averages', index=False)
-                        output.seek(0)
                         st.download_button(
                             label="Download Full Results",
-                            data=output,
+                            data=to_excel_bytes(results_df, locals().get('style_avg')),
                             file_name="growth_vs_value_performance.xlsx",
                             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                         )
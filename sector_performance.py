@@ -2,9 +2,13 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import yfinance as yf
+from yfinance import shared as yf_shared
 from datetime import datetime, timedelta
-import plotly.express as px
-import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import diskcache
+from curl_cffi import requests as curl_requests
 
 # App title and description
 st.set_page_config(page_title="Sector Performance Tracker", layout="wide")
@@ -42,33 +46,80 @@ with st.sidebar:
 
     analyze_button = st.button("Analyze Sector Performance")
 
+# On-disk cache that survives server restarts; sector metadata changes far
+# less often than prices, so it is kept longer
+disk_cache = diskcache.Cache('.yf_cache')
+PRICE_CACHE_TTL = 3600
+INFO_CACHE_TTL = 24 * 3600
+
+# One keep-alive session reused across threads and reruns. yfinance keeps the
+# session it is given process-wide, so yf.download ends up on it too
+@st.cache_resource
+def get_yf_session():
+    return curl_requests.Session(impersonate="chrome")
+
+def cache_key(*parts):
+    return hashlib.md5(":".join(str(p) for p in parts).encode()).hexdigest()
+
 @st.cache_data(ttl=3600)
 def get_sector_info(ticker):
+    key = cache_key('info', ticker)
+    cached = disk_cache.get(key)
+    if cached is not None:
+        return cached
     try:
-        stock = yf.Ticker(ticker)
+        stock = yf.Ticker(ticker, session=get_yf_session())
         info = stock.info
-        return {
+        sector_info = {
             'sector': info.get('sector', 'Unknown'),
             'industry': info.get('industry', 'Unknown'),
             'company': info.get('longName', ticker)
         }
-    except Exception as e:
-        st.warning(f"Couldn't fetch info for {ticker}: {str(e)}")
-        return {'sector': 'Unknown', 'industry': 'Unknown', 'company': ticker}
-
-def calculate_returns(ticker, days):
-    end_date = datetime.today()
-    start_date = end_date - timedelta(days=days)
-    try:
-        data = yf.download(ticker, start=start_date, end=end_date, progress=False)
-        if len(data) > 0:
-            start_price = data['Close'].iloc[0]
-            end_price = data['Close'].iloc[-1]
-            return (end_price - start_price) / start_price * 100
-        return np.nan
-    except Exception as e:
-        st.warning(f"Couldn't fetch data for {ticker}: {str(e)}")
-        return np.nan
+    except Exception:
+        # Reported by the caller
+        return None
+    disk_cache.set(key, sector_info, expire=INFO_CACHE_TTL)
+    return sector_info
+
+def yahoo_rate_limited():
+    # yf.download records per-ticker failures here instead of raising them
+    return any('Too Many Requests' in str(err) for err in getattr(yf_shared, '_ERRORS', {}).values())
+
+def download_prices(tickers, start_date):
+    key = cache_key('prices', ",".join(sorted(tickers)), start_date.date())
+    cached = disk_cache.get(key)
+    if cached is not None:
+        return cached
+    # A single call; yf.download already fetches each ticker on its own thread
+    panel = yf.download(
+        tickers,
+        start=start_date,
+        group_by='ticker',
+        threads=True,
+        progress=False,
+        auto_adjust=False
+    )
+    # 429 gaps are transient, so don't keep them as "no price data" for an hour
+    if not panel.empty and not yahoo_rate_limited():
+        disk_cache.set(key, panel, expire=PRICE_CACHE_TTL)
+    return panel
+
+def compute_returns_matrix(closes, timeframe_days):
+    # closes is (dates, tickers). Each column's NaNs are moved to the top so
+    # the valid bars sit at the bottom in date order, then every ticker and
+    # window is sliced at once; a d-day window compares against d bars back.
+    n_dates, n_tickers = closes.shape
+    if n_dates == 0:
+        return np.full((n_tickers, len(timeframe_days)), np.nan)
+    valid = ~np.isnan(closes)
+    packed = np.take_along_axis(closes, np.argsort(valid, axis=0, kind='stable'), axis=0)
+    counts = valid.sum(axis=0)
+    day_offsets = np.fromiter(timeframe_days.values(), dtype=np.intp)
+    k = np.minimum(day_offsets[:, None], counts - 1)
+    start = packed[n_dates - 1 - np.maximum(k, 0), np.arange(n_tickers)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.where(k > 0, (packed[-1] / start - 1) * 100, np.nan)
+    return returns.T
 
 def analyze_sectors(tickers, timeframes):
     if not tickers:
@@ -76,44 +127,127 @@ def analyze_sectors(tickers, timeframes):
         return None
 
     timeframe_days = {tf: int(tf.split()[0]) for tf in timeframes}
+    max_days = max(timeframe_days.values())
+    # Timeframes count trading bars, so fetch enough calendar days to cover
+    # weekends and holidays for the longest one
+    start_date = datetime.today() - timedelta(days=max_days * 2 + 5)
+
+    # One batched request for the longest window; shorter windows are sliced locally
+    panel = download_prices(tickers, start_date)
+    if panel.columns.nlevels > 1 and 'Close' in panel.columns.get_level_values(1):
+        closes = panel.xs('Close', axis=1, level=1).reindex(columns=tickers).to_numpy(dtype=np.float64)
+    else:
+        closes = np.empty((0, len(tickers)))
+    returns_mat = compute_returns_matrix(closes, timeframe_days)
+
+    # Tickers without usable prices are dropped before the metadata lookups
+    valid = ~np.isnan(returns_mat).all(axis=1)
+    if not valid.any():
+        st.error("No valid data could be retrieved for the provided tickers.")
+        return None
+    failed = [t for t, ok in zip(tickers, valid) if not ok]
+    if failed:
+        more = "..." if len(failed) > 10 else ""
+        st.warning(f"No price data for {len(failed)} tickers: {', '.join(failed[:10])}{more}")
+    tickers = [t for t, ok in zip(tickers, valid) if ok]
+    returns_mat = returns_mat[valid]
 
     progress_bar = st.progress(0)
     status_text = st.empty()
-    results = []
     total_tickers = len(tickers)
-
-    for i, ticker in enumerate(tickers):
-        status_text.text(f"Processing {ticker} ({i+1}/{total_tickers})...")
-        progress_bar.progress((i + 1) / total_tickers)
-
-        sector_info = get_sector_info(ticker)
-        returns = {}
-
-        for tf_label, days in timeframe_days.items():
-            ret = calculate_returns(ticker, days)
-            # Ensure ret is scalar, not Series
-            if isinstance(ret, pd.Series):
-                ret = ret.iloc[0] if not ret.empty else np.nan
-            if not pd.isna(ret):
-                returns[tf_label] = float(ret)
-
-        if returns:
-            results.append({
-                'Ticker': ticker,
-                'Company': sector_info['company'],
-                'Sector': sector_info['sector'],
-                'Industry': sector_info['industry'],
-                **returns
-            })
+    # Throttle UI updates
+    update_step = max(1, total_tickers // 50)
+
+    # Fetch sector info in parallel
+    info_map = {}
+    with ThreadPoolExecutor(max_workers=min(16, total_tickers)) as executor:
+        futures = {executor.submit(get_sector_info, ticker): ticker for ticker in tickers}
+        for done, future in enumerate(as_completed(futures), start=1):
+            ticker = futures[future]
+            info_map[ticker] = future.result()
+            if done % update_step == 0 or done == total_tickers:
+                status_text.text(f"Fetched info for {ticker} ({done}/{total_tickers})...")
+                progress_bar.progress(done / total_tickers)
 
     progress_bar.empty()
     status_text.empty()
 
-    if not results:
-        st.error("No valid data could be retrieved for the provided tickers.")
-        return None
-
-    return pd.DataFrame(results)
+    info_failed = [t for t in tickers if info_map[t] is None]
+    if info_failed:
+        more = "..." if len(info_failed) > 10 else ""
+        st.warning(f"Couldn't fetch info for {len(info_failed)} tickers: {', '.join(info_failed[:10])}{more}")
+        for ticker in info_failed:
+            info_map[ticker] = {'sector': 'Unknown', 'industry': 'Unknown', 'company': ticker}
+
+    companies = [info_map[t]['company'] for t in tickers]
+    sectors = [info_map[t]['sector'] for t in tickers]
+    industries = [info_map[t]['industry'] for t in tickers]
+
+    return pd.DataFrame({
+        'Ticker': tickers,
+        'Company': companies,
+        'Sector': pd.Categorical(sectors),
+        'Industry': industries,
+        **{tf: returns_mat[:, j] for j, tf in enumerate(timeframe_days)}
+    })
+
+def compute_sector_averages(results_df, numeric_cols):
+    # Per-sector NaN-skipping means via scatter-adds over integer sector codes,
+    # which is cheaper than a groupby for a few dozen sectors
+    codes, sector_names = pd.factorize(results_df['Sector'])
+    values = results_df[numeric_cols].to_numpy(dtype=np.float64)
+    keep = codes >= 0
+    codes, values = codes[keep], values[keep]
+    present = ~np.isnan(values)
+    sums = np.zeros((len(sector_names), len(numeric_cols)))
+    counts = np.zeros_like(sums)
+    np.add.at(sums, codes, np.where(present, values, 0.0))
+    np.add.at(counts, codes, present)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return pd.DataFrame(means, index=pd.Index(sector_names, name='Sector'), columns=numeric_cols)
+
+@st.cache_data(show_spinner=False)
+def build_sector_bar(sector_avg_dict, tf):
+    # Lazy import
+    import plotly.express as px
+
+    sorted_avg = pd.DataFrame(sector_avg_dict).sort_values(by=tf, ascending=False)
+    fig = px.bar(
+        sorted_avg,
+        x='Sector',
+        y=tf,
+        title=f'Sector Performance ({tf})',
+        labels={tf: 'Return (%)'},
+        color=tf,
+        color_continuous_scale=px.colors.diverging.RdYlGn,
+        height=500
+    )
+    fig.update_layout(
+        xaxis_title="Sector",
+        yaxis_title="Return (%)",
+        hovermode="x"
+    )
+    return fig.to_json()
+
+@st.cache_data(show_spinner=False)
+def to_excel_bytes(results_df, sector_avg):
+    import io
+    from openpyxl import Workbook
+
+    # Stream rows through a write-only workbook
+    workbook = Workbook(write_only=True)
+    sheets = [('Stock Performance', results_df)]
+    if sector_avg is not None:
+        sheets.append(('Sector Averages', sector_avg))
+    for sheet_name, df in sheets:
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.append([str(col) for col in df.columns])
+        for row in df.itertuples(index=False, name=None):
+            worksheet.append([None if pd.isna(v) else v for v in row])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
 
 if analyze_button:
     try:
@@ -126,21 +260,22 @@ if analyze_button:
 
                 ticker_columns = [col for col in df.columns if 'ticker' in col.lower() or 'symbol' in col.lower()]
                 if ticker_columns:
-                    tickers = df[ticker_columns[0]].dropna().astype(str).str.upper().unique().tolist()
+                    tickers = df[ticker_columns[0]].dropna().astype(str).tolist()
                 else:
-                    tickers = df.iloc[:, 0].dropna().astype(str).str.upper().unique().tolist()
+                    tickers = df.iloc[:, 0].dropna().astype(str).tolist()
             except Exception as e:
                 st.error(f"Error reading file: {e}")
                 tickers = []
         elif upload_option == "Enter Manually" and manual_tickers:
             if "," in manual_tickers:
-                tickers = [t.strip().upper() for t in manual_tickers.split(",")]
+                tickers = manual_tickers.split(",")
             else:
-                tickers = [t.strip().upper() for t in manual_tickers.split("\n") if t.strip()]
+                tickers = manual_tickers.split("\n")
         else:
             tickers = []
 
-        tickers = [t for t in tickers if t and not t.isspace()]
+        # Normalize and dedupe in one place (keeping input order) so no ticker is fetched twice
+        tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t and t.strip()))
 
         if not tickers:
             st.warning("Please provide valid ticker symbols")
@@ -156,13 +291,9 @@ if analyze_button:
                     # Display raw data with proper error handling
                     st.subheader("Raw Data")
                     try:
-                        display_df = results_df.copy()
-                        for tf in timeframes:
-                            if tf in display_df.columns:
-                                display_df[tf] = pd.to_numeric(display_df[tf], errors='coerce')
-
-                        format_dict = {tf: "{:.2f}%" for tf in timeframes if tf in display_df.columns}
-                        st.dataframe(display_df.style.format(format_dict))
+                        # Return columns are already float64, so style the frame as-is
+                        format_dict = {tf: "{:.2f}%" for tf in timeframes if tf in results_df.columns}
+                        st.dataframe(results_df.style.format(format_dict))
                     except Exception as e:
                         st.error(f"Error formatting data: {e}")
                         st.dataframe(results_df)
@@ -170,67 +301,47 @@ if analyze_button:
                     # Calculate sector averages
                     try:
                         numeric_cols = [tf for tf in timeframes if tf in results_df.columns]
-                        sector_avg = results_df.groupby('Sector')[numeric_cols].mean().reset_index()
+                        sector_means = compute_sector_averages(results_df, numeric_cols)
+                        sector_avg = sector_means.reset_index()
 
                         if not sector_avg.empty:
                             # Display sector performance
                             st.subheader("Sector Performance Averages")
 
+                            sector_avg_dict = sector_avg.to_dict('list')
                             for tf in numeric_cols:
-                                sorted_avg = sector_avg.sort_values(by=tf, ascending=False)
-                                fig = px.bar(
-                                    sorted_avg,
-                                    x='Sector',
-                                    y=tf,
-                                    title=f'Sector Performance ({tf})',
-                                    labels={tf: 'Return (%)'},
-                                    color=tf,
-                                    color_continuous_scale=px.colors.diverging.RdYlGn,
-                                    height=500
-                                )
-                                fig.update_layout(
-                                    xaxis_title="Sector",
-                                    yaxis_title="Return (%)",
-                                    hovermode="x"
-                                )
-                                st.plotly_chart(fig, use_container_width=True)
+                                fig_json = build_sector_bar(sector_avg_dict, tf)
+                                st.plotly_chart(json.loads(fig_json), use_container_width=True)
 
                             # Show best/worst performing sectors
                             st.subheader("Performance Highlights")
 
+                            best_sectors = sector_means.idxmax()
+                            worst_sectors = sector_means.idxmin()
+                            best_values = sector_means.max()
+                            worst_values = sector_means.min()
+
                             cols = st.columns(len(numeric_cols))
                             for idx, tf in enumerate(numeric_cols):
                                 with cols[idx]:
-                                    best_sector = sector_avg.loc[sector_avg[tf].idxmax()]
-                                    worst_sector = sector_avg.loc[sector_avg[tf].idxmin()]
-                                    # Ensure values are float, not Series
-                                    best_value = float(best_sector[tf]) if not pd.isna(best_sector[tf]) else np.nan
-                                    worst_value = float(worst_sector[tf]) if not pd.isna(worst_sector[tf]) else np.nan
                                     st.metric(
                                         label=f"Best Sector ({tf})",
-                                        value=best_sector['Sector'],
-                                        delta=f"{best_value:.2f}%"
+                                        value=best_sectors[tf],
+                                        delta=f"{float(best_values[tf]):.2f}%"
                                     )
                                     st.metric(
                                         label=f"Worst Sector ({tf})",
-                                        value=worst_sector['Sector'],
-                                        delta=f"{worst_value:.2f}%"
+                                        value=worst_sectors[tf],
+                                        delta=f"{float(worst_values[tf]):.2f}%"
                                     )
                     except Exception as e:
                         st.error(f"Error calculating sector averages: {e}")
 
                     # Download button for results
                     try:
-                        output = io.BytesIO()
-                        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                            results_df.to_excel(writer, sheet_name='Stock Performance', index=False)
-                            if 'sector_avg' in locals():
-                                sector_avg.to_excel(writer, sheet_name='Sector Averages', index=False)
-                        output.seek(0)
-
                         st.download_button(
                             label="Download Full Results",
-                            data=output,
+                            data=to_excel_bytes(results_df, locals().get('sector_avg')),
                             file_name="sector_performance_analysis.xlsx",
                             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                         )
@@ -60,10 +60,11 @@ def calculate_returns(ticker, days):
     start_date = end_date - timedelta(days=days)
     try:
         data = yf.download(ticker, start=start_date, end=end_date, progress=False)
-        if len(data) > 0:
-            start_price = data['Close'].iloc[0]
-            end_price = data['Close'].iloc[-1]
-            return (end_price - start_price) / start_price * 100
+        # Raw ndarray view; ravel() also flattens the single-column frame yfinance
+        # returns for 'Close' when the columns are a MultiIndex
+        close = data['Close'].to_numpy().ravel()
+        if len(close) > 0:
+            return (close[-1] - close[0]) / close[0] * 100
         return np.nan
     except Exception:
         return np.nan
@@ -94,8 +95,6 @@ def analyze_sectors(tickers, timeframes):
         returns = {}
         for tf_label, days in timeframe_days.items():
             ret = calculate_returns(ticker, days)
-            if isinstance(ret, pd.Series):
-                ret = ret.iloc[0] if not ret.empty else np.nan
             if not pd.isna(ret):
                 returns[tf_label] = float(ret)
         if returns:
@@ -150,12 +149,9 @@ if analyze_button:
                     # RAW DATA DISPLAY
                     st.subheader("Raw Data")
                     try:
-                        display_df = results_df.copy()
-                        for tf in timeframes:
-                            if tf in display_df.columns:
-                                display_df[tf] = pd.to_numeric(display_df[tf], errors='coerce')
-                        format_dict = {tf: "{:.2f}%" for tf in timeframes if tf in display_df.columns}
-                        st.dataframe(display_df.style.format(format_dict))
+                        # Return columns are already float64, so style the frame as-is
+                        format_dict = {tf: "{:.2f}%" for tf in timeframes if tf in results_df.columns}
+                        st.dataframe(results_df.style.format(format_dict))
                     except Exception as e:
                         st.error(f"Error formatting data: {e}")
                         st.dataframe(results_df)